@@ -0,0 +1,121 @@
+"""
+Shared helpers for the Exercise Monitoring Vest dashboard scripts
+Message encoding, server timestamps and WebSocket client fan-out
+"""
+
+import asyncio
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from websockets.exceptions import ConnectionClosed
+
+from json_codec import json_dumps
+
+# MessagePack framing (optional) - clients opt in with ?format=msgpack
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Per-client outbound queue length - a client that falls this far
+# behind loses its oldest queued message
+CLIENT_QUEUE_SIZE = 64
+
+# Connected WebSocket clients, each mapped to its outbound message queue
+clients = {}
+
+# Clients that asked for MessagePack framing (subset of clients)
+msgpack_clients = set()
+
+# Outbound queues of open clients, split by wire format - rebuilt only
+# when a client connects or disconnects, not on every broadcast
+_json_queues = []
+_msgpack_queues = []
+
+# serverTime is cached and only reformatted when the second changes
+_last_sec = -1
+_last_iso = ''
+
+
+def server_time(now=None):
+    """
+    Local time as an ISO 8601 string, at one-second resolution
+    
+    now is a time.time() value; defaults to the current time.
+    """
+    global _last_sec, _last_iso
+    sec = int(time.time() if now is None else now)
+    if sec != _last_sec:
+        _last_sec = sec
+        _last_iso = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(sec))
+    return _last_iso
+
+
+def wants_msgpack(path):
+    """True if the client connected with ?format=msgpack and msgpack is installed"""
+    if msgpack is None or not path:
+        return False
+    return parse_qs(urlsplit(path).query).get('format') == ['msgpack']
+
+
+def encode_for(websocket, data):
+    """Encode data in the wire format a single client asked for"""
+    if websocket in msgpack_clients:
+        return msgpack.packb(data)
+    return json_dumps(data)
+
+
+def _rebuild_client_queues():
+    """Refresh the per-format queue lists after clients change"""
+    global _json_queues, _msgpack_queues
+    _json_queues = [q for ws, q in clients.items() if ws not in msgpack_clients]
+    _msgpack_queues = [q for ws, q in clients.items() if ws in msgpack_clients]
+
+
+def add_client(websocket, path):
+    """Register a client and return its outbound message queue"""
+    queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+    clients[websocket] = queue
+    if wants_msgpack(path):
+        msgpack_clients.add(websocket)
+    _rebuild_client_queues()
+    return queue
+
+
+def remove_client(websocket):
+    """Forget a client and its queue; safe to call more than once"""
+    if clients.pop(websocket, None) is not None:
+        msgpack_clients.discard(websocket)
+        _rebuild_client_queues()
+
+
+def enqueue(queue, message):
+    """Queue a message for one client, dropping its oldest message if full"""
+    try:
+        queue.put_nowait(message)
+    except asyncio.QueueFull:
+        queue.get_nowait()
+        queue.put_nowait(message)
+
+
+async def send_queued(websocket, queue):
+    """Forward queued messages to one client until the connection closes"""
+    try:
+        while True:
+            message = await queue.get()
+            await websocket.send(message)
+    except ConnectionClosed:
+        # Stop broadcasting to it now rather than when the handler exits
+        remove_client(websocket)
+
+
+def broadcast_message(data):
+    """Encode data at most once per wire format and queue it for all clients"""
+    if _msgpack_queues:
+        message = msgpack.packb(data)
+        for queue in _msgpack_queues:
+            enqueue(queue, message)
+    if _json_queues:
+        message = json_dumps(data)
+        for queue in _json_queues:
+            enqueue(queue, message)
@@ -0,0 +1,15 @@
+"""
+JSON encoding for the Exercise Monitoring Vest dashboard scripts
+Uses orjson when installed; json_dumps always returns bytes
+"""
+
+import json
+
+# Fast JSON encoding (optional) - orjson returns bytes, so the stdlib
+# fallback is wrapped to match
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    def json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+    json_loads = json.loads
@@ -10,65 +10,124 @@ import websockets
 import json
 import random
 import math
+import time
 from datetime import datetime
 
+from dashboard_common import (
+    add_client, broadcast_message, clients, encode_for, enqueue,
+    remove_client, send_queued, server_time
+)
+from json_codec import json_loads
+
+# Compiled vitals arithmetic (optional) - pip install numba
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 # Server configuration
 WS_HOST = 'localhost'
 WS_PORT = 8765
 
-# Global set of connected clients
-clients = set()
-
 # Simulation state
 simulation_time = 0
 session_start = datetime.now()
 
 
-def generate_realistic_vitals(elapsed_seconds):
+# Simulation loops every 10 minutes (600 seconds)
+SIMULATION_LENGTH = 600
+
+# Activity phase labels, indexed by phase id
+PHASES = ("REST", "WARM-UP", "EXERCISE", "COOL-DOWN", "RECOVERY")
+
+
+def _activity_at(elapsed_seconds):
     """
-    Generate realistic vital signs based on simulated activity level
+    Activity phase at a given second
     
-    Activity phases:
-    - 0-60s: Rest (baseline)
-    - 60-180s: Warm-up (gradual increase)
-    - 180-300s: Exercise (high intensity)
-    - 300-420s: Cool-down (gradual decrease)
-    - 420s+: Recovery (return to baseline)
+    Returns (phase_id, activity, activity_jitter). Phases with a non-zero
+    jitter add random.random() * activity_jitter on every tick.
     """
-    
-    # Calculate activity level (0.0 to 1.0)
     if elapsed_seconds < 60:
         # Rest phase
-        activity = 0.0
-        phase = "REST"
+        return 0, 0.0, 0.0
     elif elapsed_seconds < 180:
         # Warm-up: gradual increase over 2 minutes
-        activity = (elapsed_seconds - 60) / 120
-        phase = "WARM-UP"
+        return 1, (elapsed_seconds - 60) / 120, 0.0
     elif elapsed_seconds < 300:
         # Exercise: maintain high intensity with variation
-        activity = 0.9 + (random.random() * 0.2)
-        phase = "EXERCISE"
+        return 2, 0.9, 0.2
     elif elapsed_seconds < 420:
         # Cool-down: gradual decrease over 2 minutes
-        activity = 1.0 - ((elapsed_seconds - 300) / 120)
-        phase = "COOL-DOWN"
+        return 3, 1.0 - ((elapsed_seconds - 300) / 120), 0.0
     else:
         # Recovery: low activity with small variation
-        activity = 0.1 + (random.random() * 0.1)
-        phase = "RECOVERY"
+        return 4, 0.1, 0.1
+
+
+def _sweat_at(elapsed_seconds):
+    """Sweat level (0-3) at a given second - lags behind heart rate increase"""
+    if elapsed_seconds < 90:
+        return 0
+    elif elapsed_seconds < 200:
+        return 1
+    elif elapsed_seconds < 280:
+        return 2
+    elif elapsed_seconds < 400:
+        return 3
+    elif elapsed_seconds < 500:
+        return 2
+    else:
+        return 1
+
+
+def _vitals_entry(elapsed_seconds):
+    """VITALS_TABLE row for a given second"""
+    phase_id, activity, activity_jitter = _activity_at(elapsed_seconds)
+    breath_sync = int(math.sin(elapsed_seconds * 0.1) * 2)
+    return (PHASES[phase_id], activity, activity_jitter, breath_sync,
+            _sweat_at(elapsed_seconds))
+
+
+# Everything that depends only on the simulated second, computed once:
+# (phase, activity, activity_jitter, breath_sync, sweat). Phase labels
+# are the PHASES strings themselves, so every tick shares one object.
+VITALS_TABLE = tuple(_vitals_entry(t) for t in range(SIMULATION_LENGTH))
+
+# Per-tick jitter is drawn in blocks to amortise random module overhead
+JITTER_BLOCK_SIZE = 1024
+_hr_jitter = []
+_rr_jitter = []
+_lead_off = []
+_jitter_index = JITTER_BLOCK_SIZE
+
+
+def _refill_jitter():
+    """Draw the next block of heart rate, breathing rate and lead-off jitter"""
+    global _hr_jitter, _rr_jitter, _lead_off, _jitter_index
+    _hr_jitter = random.choices(range(-3, 4), k=JITTER_BLOCK_SIZE)
+    _rr_jitter = random.choices(range(-2, 3), k=JITTER_BLOCK_SIZE)
+    _lead_off = [random.random() < 0.01 for _ in range(JITTER_BLOCK_SIZE)]
+    _jitter_index = 0
+
+
+def _vitals_core(activity, activity_jitter, activity_rand, breath_sync,
+                 hr_jitter, rr_jitter):
+    """
+    Heart rate and breathing rate for one tick
+    
+    Plain scalar arithmetic so numba can compile it; all randomness is
+    drawn by the caller. Returns (hr, rr).
+    """
+    activity += activity_rand * activity_jitter
     
     # Generate Heart Rate (50-180 BPM)
     base_hr = 70
     hr_range = 110
     hr = int(base_hr + (hr_range * activity))
     
-    # Add realistic variation
-    hr += random.randint(-3, 3)
-    
-    # Add breathing-synchronized variation
-    breath_sync = math.sin(elapsed_seconds * 0.1) * 2
-    hr += int(breath_sync)
+    # Add realistic and breathing-synchronized variation
+    hr += hr_jitter + breath_sync
     
     # Clamp to realistic range
     hr = max(50, min(180, hr))
@@ -79,59 +138,95 @@ def generate_realistic_vitals(elapsed_seconds):
     rr = int(base_rr + (rr_range * activity))
     
     # Add variation
-    rr += random.randint(-2, 2)
+    rr += rr_jitter
     
     # Clamp to realistic range
     rr = max(10, min(35, rr))
     
-    # Generate Sweat Level (0-3)
-    # Sweat lags behind heart rate increase
-    if elapsed_seconds < 90:
-        sweat = 0
-    elif elapsed_seconds < 200:
-        sweat = 1
-    elif elapsed_seconds < 280:
-        sweat = 2
-    elif elapsed_seconds < 400:
-        sweat = 3
-    elif elapsed_seconds < 500:
-        sweat = 2
-    else:
-        sweat = 1
+    return hr, rr
+
+
+if njit is not None:
+    _vitals_core = njit(cache=True)(_vitals_core)
+    # Compile now rather than on the first tick
+    _vitals_core(0.0, 0.0, 0.0, 0, 0, 0)
+
+
+# Reused for every reading - broadcast_data encodes it before the next tick
+_VITALS = {
+    'hr': 0,
+    'rr': 0,
+    'sweat': 0,
+    'leadOff': False,
+    'timestamp': 0,
+    'phase': ''
+}
+
+
+def generate_realistic_vitals(elapsed_seconds):
+    """
+    Generate realistic vital signs based on simulated activity level
+    
+    Activity phases:
+    - 0-60s: Rest (baseline)
+    - 60-180s: Warm-up (gradual increase)
+    - 180-300s: Exercise (high intensity)
+    - 300-420s: Cool-down (gradual decrease)
+    - 420s+: Recovery (return to baseline)
+    
+    Returns a shared dict that is overwritten by the next call.
+    """
+    global _jitter_index
+    
+    phase, activity, activity_jitter, breath_sync, sweat = \
+        VITALS_TABLE[elapsed_seconds % SIMULATION_LENGTH]
+    
+    if _jitter_index >= JITTER_BLOCK_SIZE:
+        _refill_jitter()
+    i = _jitter_index
+    _jitter_index += 1
+    
+    activity_rand = random.random() if activity_jitter else 0.0
+    hr, rr = _vitals_core(activity, activity_jitter, activity_rand,
+                          breath_sync, _hr_jitter[i], _rr_jitter[i])
     
     # Occasional lead-off events (1% chance)
-    lead_off = random.random() < 0.01
+    lead_off = _lead_off[i]
     
-    return {
-        'hr': hr,
-        'rr': rr,
-        'sweat': sweat,
-        'leadOff': lead_off,
-        'timestamp': elapsed_seconds,
-        'phase': phase
-    }
+    _VITALS['hr'] = hr
+    _VITALS['rr'] = rr
+    _VITALS['sweat'] = sweat
+    _VITALS['leadOff'] = lead_off
+    _VITALS['timestamp'] = elapsed_seconds
+    _VITALS['phase'] = phase
+    return _VITALS
 
 
 async def handle_client(websocket):
     """Handle new WebSocket client connection (websockets 15.x compatible)"""
-    clients.add(websocket)
+    # websockets 13+ exposes the handshake as .request, older versions as .path
+    request = getattr(websocket, 'request', None)
+    queue = add_client(websocket, request.path if request is not None else websocket.path)
     client_id = id(websocket)
     print(f"✅ Client {client_id} connected (Total: {len(clients)})")
     
+    # Send initial connection confirmation ahead of any broadcast
+    welcome_msg = {
+        'type': 'connection',
+        'message': 'Connected to Mock Data Server',
+        'serverTime': server_time()
+    }
+    enqueue(queue, encode_for(websocket, welcome_msg))
+    
+    # All sends to this client go through its queue
+    sender = asyncio.create_task(send_queued(websocket, queue))
+    
     try:
-        # Send initial connection confirmation
-        welcome_msg = {
-            'type': 'connection',
-            'message': 'Connected to Mock Data Server',
-            'serverTime': datetime.now().isoformat()
-        }
-        await websocket.send(json.dumps(welcome_msg))
-        
         # Keep connection open
         async for message in websocket:
             # Handle any messages from client (optional)
             try:
-                data = json.loads(message)
+                data = json_loads(message)
                 if data.get('type') == 'command':
                     print(f"📨 Received command from client: {data.get('command')}")
             except json.JSONDecodeError:
@@ -140,7 +235,8 @@ async def handle_client(websocket):
     except websockets.exceptions.ConnectionClosed:
         pass
     finally:
-        clients.remove(websocket)
+        sender.cancel()
+        remove_client(websocket)
         print(f"❌ Client {client_id} disconnected (Total: {len(clients)})")
 
 
@@ -154,23 +250,23 @@ async def broadcast_data():
     
     update_count = 0
     
+    # Ticks run against fixed 1-second deadlines so the rate does not
+    # drift; serverTime is taken from the deadline, not the wall clock
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
+    tick_time = time.time()
+    
     while True:
         try:
             # Generate vital signs data
             data = generate_realistic_vitals(simulation_time)
             
             # Add server timestamp
-            data['serverTime'] = datetime.now().isoformat()
+            data['serverTime'] = server_time(tick_time)
             
             # Broadcast to all connected clients
             if clients:
-                message = json.dumps(data)
-                
-                # Send to all clients concurrently
-                await asyncio.gather(
-                    *[client.send(message) for client in clients],
-                    return_exceptions=True
-                )
+                broadcast_message(data)
                 
                 update_count += 1
                 
@@ -187,16 +283,22 @@ async def broadcast_data():
             simulation_time += 1
             
             # Reset after 10 minutes (600 seconds) to loop
-            if simulation_time >= 600:
+            if simulation_time >= SIMULATION_LENGTH:
                 simulation_time = 0
                 print("\n🔄 Restarting simulation cycle...\n")
             
-            # Wait 1 second between updates
-            await asyncio.sleep(1.0)
+            # Wait for the next 1-second deadline
+            next_tick += 1.0
+            tick_time += 1.0
+            await asyncio.sleep(max(0, next_tick - loop.time()))
             
         except Exception as e:
             print(f"⚠️  Error in broadcast: {e}")
             await asyncio.sleep(1.0)
+            
+            # Start a fresh schedule rather than bursting to catch up
+            next_tick = loop.time()
+            tick_time = time.time()
 
 
 async def main():
@@ -250,6 +352,13 @@ if __name__ == "__main__":
         print("   pip install -r requirements.txt")
         exit(1)
     
+    # Use uvloop's faster event loop when available
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    
     # Run the server
     try:
         print("\n🚀 Starting Mock Data Server...\n")
@@ -5,11 +5,17 @@ Reads JSON data from Arduino serial port and broadcasts to WebSocket clients
 """
 
 import serial
-import json
+import serial_asyncio
 import asyncio
 import websockets
 import sys
-from datetime import datetime
+import time
+
+from dashboard_common import (
+    add_client, broadcast_message, clients, remove_client, send_queued,
+    server_time
+)
+from json_codec import json_loads
 
 # Configuration
 SERIAL_PORT = '/dev/cu.usbserial-14310'  # Mac/Linux - Change to your port
@@ -18,92 +24,93 @@ BAUD_RATE = 115200
 WS_HOST = 'localhost'
 WS_PORT = 8765
 
-# Global set of connected WebSocket clients
-clients = set()
-
 
 async def handle_client(websocket, path):
     """Handle new WebSocket client connection"""
-    clients.add(websocket)
+    queue = add_client(websocket, path)
     print(f"New client connected. Total clients: {len(clients)}")
     
+    # All sends to this client go through its queue
+    sender = asyncio.create_task(send_queued(websocket, queue))
+    
     try:
-        # Keep connection open and wait for messages (we don't expect any)
-        async for message in websocket:
-            # Echo back if needed for debugging
-            pass
-    except websockets.exceptions.ConnectionClosed:
-        pass
+        # The dashboard never sends anything, so just wait for it to leave
+        await websocket.wait_closed()
     finally:
-        clients.remove(websocket)
+        sender.cancel()
+        remove_client(websocket)
         print(f"Client disconnected. Total clients: {len(clients)}")
 
 
 async def broadcast_data():
     """Read from serial port and broadcast to all WebSocket clients"""
     try:
-        # Open serial connection
-        ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
+        # Open serial connection - reads are driven by the event loop,
+        # so there is no polling and the loop never blocks on readline()
+        reader, writer = await serial_asyncio.open_serial_connection(
+            url=SERIAL_PORT, baudrate=BAUD_RATE
+        )
         print(f"✅ Connected to Arduino on {SERIAL_PORT} at {BAUD_RATE} baud")
         print(f"Waiting for data...")
         
         line_count = 0
+        last_debug_time = 0.0
         
         while True:
             try:
-                # Read line from serial
-                if ser.in_waiting > 0:
-                    line = ser.readline().decode('utf-8', errors='ignore').strip()
-                    
-                    if not line:
-                        await asyncio.sleep(0.01)
-                        continue
-                    
-                    line_count += 1
-                    
-                    # Try to parse as JSON
-                    if line.startswith('{'):
-                        try:
-                            data = json.loads(line)
-                            
-                            # Add server timestamp
-                            data['serverTime'] = datetime.now().isoformat()
-                            
-                            # Broadcast to all connected clients
-                            if clients:
-                                message = json.dumps(data)
-                                
-                                # Send to all clients concurrently
-                                await asyncio.gather(
-                                    *[client.send(message) for client in clients],
-                                    return_exceptions=True
-                                )
-                                
-                                # Log every 10th message to avoid spam
-                                if line_count % 10 == 0:
-                                    print(f"📊 Broadcast #{line_count}: HR={data.get('hr', 'N/A')} "
-                                          f"RR={data.get('rr', 'N/A')} Sweat={data.get('sweat', 'N/A')} "
-                                          f"({len(clients)} clients)")
+                # Wait for the next line from serial
+                line = await reader.readline()
+                
+                if not line:
+                    raise serial.SerialException("serial port closed")
+                
+                line_count += 1
+                
+                # Try to parse as JSON - raw bytes, trailing \r\n is fine
+                if line[:1] == b'{':
+                    try:
+                        # Bad lines fail to parse and are dropped here
+                        data = json_loads(line)
+                        
+                        # Add server timestamp
+                        data['serverTime'] = server_time()
+                        
+                        # Broadcast to all connected clients
+                        if clients:
+                            broadcast_message(data)
                             
-                        except json.JSONDecodeError as e:
-                            if line_count % 20 == 0:  # Only show occasional errors
-                                print(f"⚠️  Invalid JSON: {line[:50]}... Error: {e}")
-                    
-                    else:
-                        # Non-JSON line (probably debug output)
-                        if line_count % 20 == 0:
-                            print(f"📝 Debug: {line[:80]}")
+                            # Log every 10th message to avoid spam
+                            if line_count % 10 == 0:
+                                print(f"📊 Broadcast #{line_count}: HR={data.get('hr', 'N/A')} "
+                                      f"RR={data.get('rr', 'N/A')} Sweat={data.get('sweat', 'N/A')} "
+                                      f"({len(clients)} clients)")
+                        
+                    except ValueError as e:
+                        # JSONDecodeError, or UnicodeDecodeError from the
+                        # stdlib fallback on raw bytes
+                        if line_count % 20 == 0:  # Only show occasional errors
+                            text = line[:50].decode('utf-8', errors='ignore')
+                            print(f"⚠️  Invalid JSON: {text}... Error: {e}")
                 
-                # Small delay to prevent CPU spinning
-                await asyncio.sleep(0.01)
+                else:
+                    # Non-JSON line (probably debug output) - only decoded
+                    # when shown, at most once per second
+                    now = time.monotonic()
+                    if now - last_debug_time >= 1.0:
+                        text = line.decode('utf-8', errors='ignore').strip()
+                        if text:
+                            last_debug_time = now
+                            print(f"📝 Debug: {text[:80]}")
                 
             except serial.SerialException as e:
                 print(f"❌ Serial error: {e}")
                 print("Attempting to reconnect in 5 seconds...")
                 await asyncio.sleep(5)
                 try:
-                    ser.close()
-                    ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
+                    writer.close()
+                    reader, writer = await serial_asyncio.open_serial_connection(
+                        url=SERIAL_PORT, baudrate=BAUD_RATE
+                    )
                     print("✅ Reconnected to serial port")
                 except Exception as reconnect_error:
                     print(f"❌ Reconnection failed: {reconnect_error}")
@@ -127,7 +134,7 @@ async def broadcast_data():
     
     except KeyboardInterrupt:
         print("\n\n🛑 Shutting down...")
-        ser.close()
+        writer.close()
         sys.exit(0)
 
 
@@ -155,15 +162,23 @@ if __name__ == "__main__":
     # Check if required packages are installed
     try:
         import serial
+        import serial_asyncio
         import websockets
     except ImportError as e:
         print(f"❌ Missing required package: {e}")
         print("\nPlease install required packages:")
-        print("   pip install pyserial websockets")
+        print("   pip install pyserial pyserial-asyncio websockets")
         print("\nOr install all requirements:")
         print("   pip install -r requirements.txt")
         sys.exit(1)
     
+    # Use uvloop's faster event loop when available
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    
     # Run the async main function
     try:
         asyncio.run(main())
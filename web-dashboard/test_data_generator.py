@@ -4,12 +4,70 @@ Test Data Generator for Exercise Monitoring Vest Dashboard
 Simulates Arduino serial output for testing without hardware
 """
 
-import json
+import sys
 import time
 import random
 import math
+from bisect import bisect_right
 from datetime import datetime
 
+from json_codec import json_dumps
+
+
+class JsonLineWriter:
+    """
+    Write JSON lines straight to the binary stdout buffer
+    
+    Falls back to text writes when stdout has no buffer (IDLE, Jupyter,
+    redirected streams). Lines are flushed in batches - every flush_every lines, or once
+    flush_interval seconds have passed - instead of once per print().
+    """
+    
+    def __init__(self, flush_every=16, flush_interval=0.5):
+        # Anything already print()ed must come out first
+        sys.stdout.flush()
+        self.stdout = sys.stdout
+        self.out = getattr(sys.stdout, 'buffer', None)
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.pending = 0
+        self.last_flush = time.monotonic()
+    
+    def write(self, data):
+        if self.out is not None:
+            self.out.write(json_dumps(data))
+            self.out.write(b'\n')
+        else:
+            self.stdout.write(json_dumps(data).decode() + '\n')
+        self.pending += 1
+        
+        if (self.pending >= self.flush_every or
+                time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+    
+    def flush(self):
+        if self.out is not None:
+            self.out.flush()
+        else:
+            self.stdout.flush()
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+
+# Activity phases as parallel arrays, indexed by
+# bisect_right(PHASE_THRESHOLDS, seconds)
+PHASE_THRESHOLDS = (60, 180, 300, 420)
+PHASE_NAMES = ("REST", "WARM-UP", "EXERCISE", "COOL-DOWN", "RECOVERY")
+PHASE_STARTS = (0, 60, 180, 300, 420)
+PHASE_ACTIVITY = (0.0, 0.0, 0.9, 1.0, 0.1)   # activity at phase start
+PHASE_RAMP = (0, 120, 0, -120, 0)            # seconds per unit of activity
+PHASE_JITTER = (0.0, 0.0, 0.2, 0.0, 0.1)     # random.random() scale
+
+# Sweat levels, indexed by bisect_right(SWEAT_THRESHOLDS, seconds)
+SWEAT_THRESHOLDS = (90, 200, 280, 400, 500)
+SWEAT_LEVELS = (0, 1, 2, 3, 2, 1)
+
+
 def generate_realistic_data(elapsed_seconds):
     """
     Generate realistic vital signs data based on simulated exercise activity
@@ -28,21 +86,14 @@ def generate_realistic_data(elapsed_seconds):
     base_sweat = 0
     
     # Calculate activity level (0-1)
-    if elapsed_seconds < 60:
-        # Rest
-        activity = 0.0
-    elif elapsed_seconds < 180:
-        # Warm-up: gradual increase
-        activity = (elapsed_seconds - 60) / 120  # 0 to 1 over 120 seconds
-    elif elapsed_seconds < 300:
-        # Exercise: maintain high
-        activity = 0.9 + (random.random() * 0.2)  # 0.9 to 1.1
-    elif elapsed_seconds < 420:
-        # Cool-down: gradual decrease
-        activity = 1.0 - ((elapsed_seconds - 300) / 120)  # 1 to 0 over 120 seconds
-    else:
-        # Rest: back to baseline
-        activity = 0.1 + (random.random() * 0.1)  # 0.1 to 0.2
+    phase = bisect_right(PHASE_THRESHOLDS, elapsed_seconds)
+    activity = PHASE_ACTIVITY[phase]
+    if PHASE_RAMP[phase]:
+        # Warm-up / cool-down: linear change over the phase
+        activity += (elapsed_seconds - PHASE_STARTS[phase]) / PHASE_RAMP[phase]
+    if PHASE_JITTER[phase]:
+        # Exercise / recovery: random variation on top
+        activity += random.random() * PHASE_JITTER[phase]
     
     # Generate heart rate (50-180 BPM range)
     hr_range = 110  # 180 - 70
@@ -70,18 +121,7 @@ def generate_realistic_data(elapsed_seconds):
     
     # Generate sweat level (0-3)
     # Sweat lags behind HR increase (slower response)
-    if elapsed_seconds < 90:
-        sweat = 0
-    elif elapsed_seconds < 200:
-        sweat = 1
-    elif elapsed_seconds < 280:
-        sweat = 2
-    elif elapsed_seconds < 400:
-        sweat = 3
-    elif elapsed_seconds < 500:
-        sweat = 2
-    else:
-        sweat = 1
+    sweat = SWEAT_LEVELS[bisect_right(SWEAT_THRESHOLDS, elapsed_seconds)]
     
     # Random lead-off events (1% chance)
     lead_off = random.random() < 0.01
@@ -116,48 +156,47 @@ def simulate_exercise_session(duration_seconds=600, update_rate=1.0):
     print("=" * 60)
     print("\nGenerating data... (Press Ctrl+C to stop)\n")
     
-    start_time = time.time()
     update_interval = 1.0 / update_rate
+    total_updates = int(duration_seconds * update_rate)
+    elapsed = 0
+    
+    # Fixed update cadence, so count ticks instead of reading the clock;
+    # the deadline only keeps sleep() from drifting
+    next_tick = time.monotonic()
+    writer = JsonLineWriter()
     
     try:
-        while True:
-            elapsed = time.time() - start_time
-            
-            if elapsed > duration_seconds:
-                print(f"\n✅ Session complete ({duration_seconds}s)")
-                break
+        for tick in range(total_updates):
+            elapsed = int(tick * update_interval)
             
             # Generate data
-            data = generate_realistic_data(int(elapsed))
+            data = generate_realistic_data(elapsed)
             
-            # Format as JSON (matching Arduino output)
-            json_output = json.dumps(data)
-            print(json_output)
+            # Format as JSON (same encoding as the other modes)
+            writer.write(data)
             
             # Show progress every 30 seconds
-            if int(elapsed) % 30 == 0 and int(elapsed) > 0:
-                phase = get_activity_phase(int(elapsed))
-                print(f"# Progress: {int(elapsed)}s / {duration_seconds}s - Phase: {phase}")
+            if elapsed % 30 == 0 and elapsed > 0:
+                phase = get_activity_phase(elapsed)
+                writer.flush()
+                print(f"# Progress: {elapsed}s / {duration_seconds}s - Phase: {phase}",
+                      flush=True)
             
             # Wait for next update
-            time.sleep(update_interval)
+            next_tick += update_interval
+            time.sleep(max(0, next_tick - time.monotonic()))
+        
+        writer.flush()
+        print(f"\n✅ Session complete ({duration_seconds}s)")
             
     except KeyboardInterrupt:
-        print(f"\n\n🛑 Stopped at {int(elapsed)}s")
+        writer.flush()
+        print(f"\n\n🛑 Stopped at {elapsed}s")
 
 
 def get_activity_phase(seconds):
     """Get current activity phase description"""
-    if seconds < 60:
-        return "REST"
-    elif seconds < 180:
-        return "WARM-UP"
-    elif seconds < 300:
-        return "EXERCISE"
-    elif seconds < 420:
-        return "COOL-DOWN"
-    else:
-        return "RECOVERY"
+    return PHASE_NAMES[bisect_right(PHASE_THRESHOLDS, seconds)]
 
 
 def stress_test(duration=60):
@@ -173,14 +212,17 @@ def stress_test(duration=60):
     print()
     
     start_time = time.time()
+    writer = JsonLineWriter()
     
     try:
         while time.time() - start_time < duration:
             elapsed = int(time.time() - start_time)
             data = generate_realistic_data(elapsed)
-            print(json.dumps(data))
+            writer.write(data)
             time.sleep(0.1)  # 10 Hz
+        writer.flush()
     except KeyboardInterrupt:
+        writer.flush()
         print("\n🛑 Stress test stopped")
 
 
@@ -199,21 +241,24 @@ def demo_mode():
         (480, "RECOVERY - Return to Baseline", 10)
     ]
     
+    writer = JsonLineWriter()
+    
     try:
         for start_time, description, duration in scenarios:
-            print(f"\n📍 Scenario: {description} ({duration}s)")
+            writer.flush()
+            print(f"\n📍 Scenario: {description} ({duration}s)", flush=True)
             for i in range(duration):
                 elapsed = start_time + (i * 6)  # Accelerate time
                 data = generate_realistic_data(elapsed)
-                print(json.dumps(data))
+                writer.write(data)
                 time.sleep(1)
+        writer.flush()
     except KeyboardInterrupt:
+        writer.flush()
         print("\n🛑 Demo stopped")
 
 
 if __name__ == "__main__":
-    import sys
-    
     print("\n" + "="*60)
     print("EXERCISE MONITORING VEST - TEST DATA GENERATOR")
     print("="*60)